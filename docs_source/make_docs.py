@@ -2,12 +2,66 @@
 
 import os
 import argparse
+import shutil
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import nbformat
+from nbconvert import MarkdownExporter
+from nbconvert.preprocessors import ExecutePreprocessor
+
+DOCS_REL_PATH = Path('../docs/docs/')
 
 # parse the command line arguments
 parser = argparse.ArgumentParser(description='Convert .ipynb files to .md files')
 parser.add_argument('--filenames', type=str, nargs='+', help='list of filenames to convert')
+parser.add_argument('--workers', type=int, default=1,
+                    help='number of notebooks to process in parallel')
+parser.add_argument('--update-ipynb', action='store_true',
+                    help='also write the executed notebook back to the source file')
 args = parser.parse_args()
 
+# created lazily and reused across notebooks so we don't pay the kernel
+# manager setup cost once per file (each pool worker gets its own copy)
+_executor = None
+_exporter = None
+
+
+def process_notebook(f: str):
+    """
+    Execute the notebook and write the resulting .md file (plus any attached
+    outputs, e.g. figures) directly into the docs directory, under the same
+    directory structure as the source — a single pass with no intermediate
+    files to move afterwards.
+    """
+    global _executor, _exporter
+    if _executor is None:
+        _executor = ExecutePreprocessor(timeout=None)
+        _exporter = MarkdownExporter()
+    src = Path(f)
+    nb = nbformat.read(f, as_version=4)
+    resources = {'metadata': {'path': str(src.parent)}}
+    _executor.preprocess(nb, resources=resources)
+    if args.update_ipynb:
+        # in-place update of the source notebook is opt-in: it is only needed
+        # when the stored outputs should be refreshed, and skipping it avoids
+        # dirtying the working tree on every docs build
+        nbformat.write(nb, f)
+    target_dir = DOCS_REL_PATH / src.parent
+    target_dir.mkdir(parents=True, exist_ok=True)
+    files_dir = src.stem + '_files'
+    body, md_resources = _exporter.from_notebook_node(
+        nb, resources={'output_files_dir': files_dir}
+    )
+    # remove any stale outputs from a previous build before writing fresh ones
+    if (target_dir / files_dir).is_dir():
+        shutil.rmtree(target_dir / files_dir)
+    (target_dir / (src.stem + '.md')).write_text(body)
+    for relpath, data in md_resources.get('outputs', {}).items():
+        out_path = target_dir / relpath
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(data)
+
 
 if __name__ == '__main__':
     if args.filenames:
@@ -22,31 +76,10 @@ if __name__ == '__main__':
                 if f.endswith('.ipynb'):
                     ipynb_files.append(os.path.join(root, f))
 
-    for f in ipynb_files:
-        os.system('jupyter nbconvert --to notebook --execute --inplace ' + f)
-        os.system(f"jupyter nbconvert --to markdown {f}")
-
-    DOCS_REL_PATH = '../docs/docs/'
-    # now, move the .md files to the docs directory
-    for f in ipynb_files:
-        # find the relative directory and the filename
-        relative_dir = os.path.dirname(f)
-        fname = os.path.basename(f)
-        # if the target dir doesn't exist, create it
-        if not os.path.isdir(DOCS_REL_PATH + relative_dir):
-            os.system("mkdir -p " + DOCS_REL_PATH + relative_dir)
-        # move to the DOCS_REL_PATH, under the same directory structure
-        mv_cmd = "mv " + f.replace('.ipynb', '.md') + " " + DOCS_REL_PATH + relative_dir + '/' + fname.replace('.ipynb', '.md')
-        print(mv_cmd)
-        os.system(mv_cmd)
-
-    # also, move any directories named "{fname}_files" to the docs directory
-    for f in ipynb_files:
-        files_folder = f.replace('.ipynb', '_files')
-        if os.path.isdir(files_folder):
-            # first, remove the directory if it already exists
-            target_files_path = DOCS_REL_PATH + files_folder
-            if os.path.isdir(target_files_path):
-                os.system(f"rm -r {DOCS_REL_PATH}" + files_folder)
-            # then, move the directory
-            os.system("mv " + f.replace('.ipynb', '_files') + " " + DOCS_REL_PATH + f.replace('.ipynb', '_files'))
\ No newline at end of file
+    if args.workers > 1:
+        # notebooks are independent of each other, so fan out across processes
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(process_notebook, ipynb_files))
+    else:
+        for f in ipynb_files:
+            process_notebook(f)
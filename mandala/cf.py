@@ -17,6 +17,7 @@ from .utils import (
     get_edges_in_paths
 )
 from .model import Call, Ref, Op, __make_list__, RefCollection, CallCollection
+from .model import AtomRef, recurse_on_ref_collections
 
 from .viz import Node, Edge, SOLARIZED_LIGHT, to_dot_string, write_output
 
@@ -109,6 +110,12 @@ class ComputationFrame:
         self.refs = {} if refs is None else refs
         self.calls = {} if calls is None else calls
 
+        # per-prefix counters remembering where the last search for a fresh
+        # variable/function name ended, so that allocating n names is O(n)
+        # overall instead of O(n^2) (each allocation restarting from 0)
+        self._vname_counters: Dict[str, int] = {}
+        self._fname_counters: Dict[str, int] = {}
+
     def _check(self):
         """
         Check all invariants not enforced by the data structure
@@ -235,9 +242,8 @@ class ComputationFrame:
         any other variable. 
         """
         res = self if inplace else self.copy()
-        for (src, dst, label) in res.edges():
-            if src == vname or dst == vname:
-                res._drop_edge(src, dst, label)
+        for (src, dst, label) in res.in_edges(vname) | res.out_edges(vname):
+            res._drop_edge(src, dst, label)
         hids = list(res.vs[vname])
         for hid in hids:
             res.drop_ref(vname, hid)
@@ -288,9 +294,8 @@ class ComputationFrame:
 
     def drop_func(self, fname: str, inplace: bool = False) -> Optional["ComputationFrame"]:
         res = self if inplace else self.copy()
-        for (src, dst, label) in res.edges():
-            if src == fname or dst == fname:
-                res._drop_edge(src, dst, label)
+        for (src, dst, label) in res.in_edges(fname) | res.out_edges(fname):
+            res._drop_edge(src, dst, label)
         hids = res.fs[fname]
         for hid in hids:
             res.drop_call(fname, hid)
@@ -303,7 +308,9 @@ class ComputationFrame:
         """
         Internal method to add an edge to the computation frame inplace.
         """
-        if (src, dst, label) in self.edges():
+        # check existence against the adjacency directly instead of
+        # materializing the full edge list
+        if dst in self.out[src].get(label, ()):
             if not allow_existing:
                 raise ValueError(f"Edge ({src}, {dst}, {label}) already exists")
             return
@@ -430,36 +437,49 @@ class ComputationFrame:
         Return (source, destination, label) tuples for all edges pointing to the
         given node.
         """
-        return {(src, dst, label) for src, dst, label in self.edges() if dst == node}
+        # read off the adjacency of the node directly instead of scanning all
+        # edges in the graph
+        return {
+            (src, node, label)
+            for label, srcs in self.inp[node].items()
+            for src in srcs
+        }
 
     def out_edges(self, node: str) -> Set[Tuple[str, str, str]]:
         """
         Return (source, destination, label) tuples for all edges pointing from
         the given node.
         """
-        return {(src, dst, label) for src, dst, label in self.edges() if src == node}
+        return {
+            (node, dst, label)
+            for label, dsts in self.out[node].items()
+            for dst in dsts
+        }
 
     @property
     def sources(self) -> Set[str]:
         return {node for node in self.vs.keys() if len(self.inp[node]) == 0}
 
-    def get_source_elts(self) -> Dict[str, Set[str]]:
+    def get_source_elts(self, restrict_to: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
         """
         Get a view of the elements in the CF which are not connected as outputs
         to any element in the CF.
 
+        If `restrict_to` is given, only the elements of these nodes are
+        considered (avoiding a pass over the full graph).
+
         Important distinctions from other natural ways of defining "sources":
             - this is **not the same** as getting the elements in the source nodes
             of the graph. There could be an intermediate node where some of the
             elements have a history in the graph and some don't.
             - this is also **not the same** as getting the elements that do not
-            have a creator *anywhere* in the graph. For example, there could be 
+            have a creator *anywhere* in the graph. For example, there could be
             a ref in some node which has a creator call somewhere in the graph,
             but the node is not connected as an output to the node containing
             that call.
         """
         res = {}
-        for node in self.nodes:
+        for node in (self.nodes if restrict_to is None else restrict_to):
             in_edges = self.in_edges(node)
             hids_with_creators = set()
             for src, dst, label in in_edges:
@@ -471,15 +491,15 @@ class ComputationFrame:
     def sinks(self) -> Set[str]:
         return {node for node in self.vs.keys() if len(self.out[node]) == 0}
 
-    def get_sink_elts(self) -> Dict[str, Set[str]]:
+    def get_sink_elts(self, restrict_to: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
         """
         Get a view of the elements in the CF which are not connected as inputs
         to any element in the CF.
 
-        Similar caveats as for `get_source_elts`.
+        Similar caveats (and `restrict_to` semantics) as for `get_source_elts`.
         """
         res = {}
-        for node in self.nodes:
+        for node in (self.nodes if restrict_to is None else restrict_to):
             out_edges = self.out_edges(node)
             hids_with_consumers = set()
             for src, dst, label in out_edges:
@@ -585,46 +605,47 @@ class ComputationFrame:
         Get the induced computation frame on these nodes, taking all edges
         connecting pairs of these nodes.
         """
-        #! must copy all sets etc. to avoid modifying the original CF
+        #! must copy all sets etc. to avoid modifying the original CF; we build
+        # fresh containers for just the selected nodes instead of deep-copying
+        # the entire CF and then throwing most of it away
         nodes_not_in_cf = set(nodes) - self.nodes
         if len(nodes_not_in_cf) > 0:
             raise ValueError(f"Nodes {nodes_not_in_cf} not found in the CF")
-        res = self.copy()
         nodes = set(nodes)
         edges = {
             (src, dst, label)
-            for src, dst, label in res.edges()
+            for src, dst, label in self.edges()
             if (src in nodes and dst in nodes)
         }
         out, inp = get_adj_from_edges(edges, node_support=nodes)
-        vs = {vname: hids for vname, hids in res.vs.items() if vname in nodes}
-        fs = {fname: call_uids for fname, call_uids in res.fs.items() if fname in nodes}
+        vs = {vname: set(hids) for vname, hids in self.vs.items() if vname in nodes}
+        fs = {fname: set(call_uids) for fname, call_uids in self.fs.items() if fname in nodes}
         ref_hids = get_nullable_union(*vs.values())
         call_hids = get_nullable_union(*fs.values())
-        refs = {hid: ref for hid, ref in res.refs.items() if hid in ref_hids}
-        calls = {hid: call for hid, call in res.calls.items() if hid in call_hids}
+        refs = {hid: ref for hid, ref in self.refs.items() if hid in ref_hids}
+        calls = {hid: call for hid, call in self.calls.items() if hid in call_hids}
         refinv = {
-            hid: vnames & set(nodes)
-            for hid, vnames in res.refinv.items()
+            hid: vnames & nodes
+            for hid, vnames in self.refinv.items()
             if hid in ref_hids
         }
         callinv = {
-            hid: fnames & set(nodes)
-            for hid, fnames in res.callinv.items()
+            hid: fnames & nodes
+            for hid, fnames in self.callinv.items()
             if hid in call_hids
         }
         creator = {
             ref_hid: call_hid
-            for ref_hid, call_hid in res.creator.items()
+            for ref_hid, call_hid in self.creator.items()
             if ref_hid in ref_hids and call_hid in call_hids
         }
         consumers = {
             ref_hid: (consumer_call_hids & call_hids)
-            for ref_hid, consumer_call_hids in res.consumers.items()
+            for ref_hid, consumer_call_hids in self.consumers.items()
             if ref_hid in ref_hids
         }
         return ComputationFrame(
-            storage=res.storage,
+            storage=self.storage,
             inp=inp,
             out=out,
             vs=vs,
@@ -641,33 +662,40 @@ class ComputationFrame:
         """
         Restrict the CF to the given elements in each node
         """
-        #! must copy all sets etc. to avoid modifying the original CF
-        res = self.copy()
-        assert set(elts.keys()) == res.nodes
-        sets = res.sets
+        #! must copy all sets etc. to avoid modifying the original CF; the
+        # adjacency is a known two-level dict-of-dicts-of-sets, so explicit
+        # structured copies do the job without deepcopy's reflective machinery
+        assert set(elts.keys()) == self.nodes
+        sets = self.sets
         assert all(elts[node] <= sets[node] for node in elts.keys())
-        out = res.out
-        inp = res.inp
-        vs = {node: elts[node] for node in res.vnames}
-        fs = {node: elts[node] for node in res.fnames}
+        out = {
+            node: {label: set(dsts) for label, dsts in nbrs.items()}
+            for node, nbrs in self.out.items()
+        }
+        inp = {
+            node: {label: set(srcs) for label, srcs in nbrs.items()}
+            for node, nbrs in self.inp.items()
+        }
+        vs = {node: elts[node] for node in self.vnames}
+        fs = {node: elts[node] for node in self.fnames}
         ref_hids_subset = get_nullable_union(*vs.values())
         call_hids_subset = get_nullable_union(*fs.values())
-        refs = {hid: res.refs[hid] for hid in ref_hids_subset}
-        calls = {hid: res.calls[hid] for hid in call_hids_subset}
-        refinv = {hid: res.refinv[hid] for hid in ref_hids_subset}
-        callinv = {hid: res.callinv[hid] for hid in call_hids_subset}
+        refs = {hid: self.refs[hid] for hid in ref_hids_subset}
+        calls = {hid: self.calls[hid] for hid in call_hids_subset}
+        refinv = {hid: set(self.refinv[hid]) for hid in ref_hids_subset}
+        callinv = {hid: set(self.callinv[hid]) for hid in call_hids_subset}
         creator = {
-            hid: res.creator[hid]
+            hid: self.creator[hid]
             for hid in ref_hids_subset
-            if hid in res.creator and res.creator[hid] in call_hids_subset
+            if hid in self.creator and self.creator[hid] in call_hids_subset
         }
         consumers = {
-            hid: res.consumers[hid] & call_hids_subset
+            hid: self.consumers[hid] & call_hids_subset
             for hid in ref_hids_subset
-            if hid in res.consumers
+            if hid in self.consumers
         }
         return ComputationFrame(
-            storage=res.storage,
+            storage=self.storage,
             inp=inp,
             out=out,
             vs=vs,
@@ -981,11 +1009,18 @@ class ComputationFrame:
             if reuse_existing:
                 group_hids = {call.hid for call in group_calls}
                 found_func_match = False
+                # compute the op name of each function node once, instead of
+                # rebuilding the full {fname -> Op} dict for every candidate
+                fname_to_op_name = {
+                    fname: self.calls[next(iter(call_hids))].op.name
+                    for fname, call_hids in self.fs.items()
+                    if call_hids
+                }
                 for fname in sorted(self.fs):
                     if group_hids <= self.fs[fname] or (self.fs[fname] <= group_hids and len(self.fs[fname]) != 0):
                         found_func_match = True
                         break
-                    elif self.ops()[fname].name == op_id:
+                    elif fname_to_op_name.get(fname) == op_id:
                         found_func_match = True
                         break
             if found_func_match:
@@ -1099,8 +1134,14 @@ class ComputationFrame:
         # TODO: when expanding forward, we don't really want to start from the 
         # sink elements, because there may be non-sink elements that don't have
         # all their consumer calls in the CF!
-        expandable_elts = res.get_source_elts() if direction == "back" else res.get_sink_elts()
-        expandable_elts = {k: v for k, v in expandable_elts.items() if k in varnames}
+        # only the requested variables can be expanded, so restrict the
+        # source/sink computation to them instead of scanning the whole graph
+        varnames = set(varnames) & res.nodes
+        expandable_elts = (
+            res.get_source_elts(restrict_to=varnames)
+            if direction == "back"
+            else res.get_sink_elts(restrict_to=varnames)
+        )
         if verbose:
             print(f'Found the following number elements to expand in direction {direction}:\n{textwrap.indent(pprint.pformat({k: len(v) for k, v in expandable_elts.items()}), "  ")}')
         ref_hids = set.union(*expandable_elts.values())
@@ -1393,11 +1434,42 @@ class ComputationFrame:
         col_types = {col: classify_obj(df[col].iloc[0]) for col in df.columns}
         if skip_calls:
             df = df[[col for col, t in col_types.items() if t != "call"]]
+
+        # the same ref typically appears in many rows of a history table, so
+        # unwrap each distinct atom once and reuse the result across cells
+        unwrapped_atoms: Dict[str, Any] = {}
+        def unwrap_atom_memoized(obj: AtomRef) -> Any:
+            if obj.hid not in unwrapped_atoms:
+                unwrapped_atoms[obj.hid] = self.storage._unwrap_atom(obj)
+            return unwrapped_atoms[obj.hid]
+        unwrap = lambda obj: recurse_on_ref_collections(unwrap_atom_memoized, obj)
+
+        # fetch all atoms not yet in memory with one batched query, so the
+        # per-cell unwrapping below runs entirely against a warm cache instead
+        # of paying a DB round-trip per cache miss
+        def prefetch_atoms(objs: Any) -> None:
+            cids: Set[str] = set()
+            def collect(obj: AtomRef) -> None:
+                if not obj.in_memory:
+                    cids.add(obj.cid)
+            recurse_on_ref_collections(collect, objs)
+            if cids:
+                self.storage.atoms.get_many(cids)
+
         if skip_cols is None:
-            values = self.storage.unwrap(df.values.tolist())
+            cells = df.values.tolist()
+            prefetch_atoms(cells)
+            values = unwrap(cells)
             return pd.DataFrame(values, columns=df.columns)
         else:
-            columns_dict = {col: df[col] if col in skip_cols else self.storage.unwrap(df[col].values.tolist()) for col in df.columns}
+            columns_dict = {}
+            for col in df.columns:
+                if col in skip_cols:
+                    columns_dict[col] = df[col]
+                else:
+                    cells = df[col].values.tolist()
+                    prefetch_atoms(cells)
+                    columns_dict[col] = unwrap(cells)
             return pd.DataFrame(columns_dict)
 
     def get(self, hids: Set[str]) -> Set[Ref]:
@@ -1654,9 +1726,17 @@ class ComputationFrame:
                     )
 
 
+        def map_cells(df: pd.DataFrame, f: Callable) -> pd.DataFrame:
+            # map column-by-column; `Series.map` avoids the per-cell dispatch
+            # overhead of `DataFrame.applymap` (deprecated in newer pandas)
+            return pd.DataFrame(
+                {col: df[col].map(f) for col in df.columns}, index=df.index
+            )
+
         history_dfs = [
-            self.get_history_df(vname, include_calls=include_calls, verbose=verbose).applymap(
-                extract_hids
+            map_cells(
+                self.get_history_df(vname, include_calls=include_calls, verbose=verbose),
+                extract_hids,
             )
             for vname in sorted_varnames
         ]
@@ -1669,7 +1749,7 @@ class ComputationFrame:
                 result, df, how=how, on=list(shared_cols), suffixes=("", "")
             )
         # go back to refs
-        result = result.applymap(eval_hids)
+        result = map_cells(result, eval_hids)
         return self._sort_df(result)
 
     @property
@@ -1706,16 +1786,19 @@ class ComputationFrame:
     ### selection
     ############################################################################
     def copy(self) -> "ComputationFrame":
+        # all the graph indices hold (dicts/sets of) plain strings, so
+        # structured shallow copies are enough; deepcopy paid the full memo
+        # machinery per element for data that is immutable anyway
         return ComputationFrame(
             storage=self.storage,
-            inp=copy.deepcopy(self.inp),
-            out=copy.deepcopy(self.out),
-            vs=copy.deepcopy(self.vs),
-            fs=copy.deepcopy(self.fs),
-            refinv=copy.deepcopy(self.refinv),
-            callinv=copy.deepcopy(self.callinv),
-            creator=copy.deepcopy(self.creator),
-            consumers=copy.deepcopy(self.consumers),
+            inp={node: {label: set(srcs) for label, srcs in d.items()} for node, d in self.inp.items()},
+            out={node: {label: set(dsts) for label, dsts in d.items()} for node, d in self.out.items()},
+            vs={vname: set(hids) for vname, hids in self.vs.items()},
+            fs={fname: set(hids) for fname, hids in self.fs.items()},
+            refinv={hid: set(vnames) for hid, vnames in self.refinv.items()},
+            callinv={hid: set(fnames) for hid, fnames in self.callinv.items()},
+            creator=dict(self.creator),
+            consumers={hid: set(call_hids) for hid, call_hids in self.consumers.items()},
             refs={k: v for k, v in self.refs.items()},
             calls={k: v for k, v in self.calls.items()},
         )
@@ -1812,11 +1895,17 @@ class ComputationFrame:
 
         # we apply each function until a fixed point is reached
         current_size = sum([len(v) for v in result.values()])
+        # the graph topology doesn't change during the iteration, so compute
+        # each node's adjacent edges once instead of on every pass
+        node_adj_edges = {
+            node: self.in_edges(node=node) if direction == "forward" else self.out_edges(node=node)
+            for node in self.nodes
+        }
         # TODO: to optimize this, we record the nodes which have changed
         # vertices_updated_last_iter = set(initial_state.keys())
         while True:
             for node in self.nodes:
-                adj_edges = self.in_edges(node=node) if direction == "forward" else self.out_edges(node=node)
+                adj_edges = node_adj_edges[node]
                 if node in self.vnames:
                     to_add = get_adj_elts(adj_edges)
                 else: # node in self.fnames
@@ -2075,10 +2164,9 @@ class ComputationFrame:
     ############################################################################
     @staticmethod
     def from_op(storage: "Storage", f: Op) -> "ComputationFrame":
-        call_hids = storage.call_storage.execute_df(
-            f'SELECT call_history_id FROM calls WHERE op="{f.name}"'
-        )["call_history_id"].unique().tolist()
-        calls = storage.mget_call(hids=call_hids, in_memory=True)
+        # a single query for all the op's calls, instead of one query for the
+        # history_ids followed by a second one re-fetching the same rows
+        calls = storage.get_op_calls(op_name=f.name, in_memory=True)
         # ensure deterministic order of inputs and outputs
         input_names = sorted(set([k for call in calls for k in call.inputs.keys()]))
         output_names = sorted(set([k for call in calls for k in call.outputs.keys()]))
@@ -2156,23 +2244,26 @@ class ComputationFrame:
             if v == "output":
                 # this is a special case
                 return self.get_new_vname('var_0')
-            i = int(name_hint.split('_')[-1])
+            i = max(int(name_hint.split('_')[-1]), self._vname_counters.get(v, 0))
             while f"{v}_{i}" in self.vs:
                 i += 1
+            self._vname_counters[v] = i + 1
             return f"{v}_{i}"
         elif name_hint not in self.vs:
             return name_hint
-        i = 0
+        i = self._vname_counters.get(name_hint, 0)
         while f"{name_hint}_{i}" in self.vs:
             i += 1
+        self._vname_counters[name_hint] = i + 1
         return f"{name_hint}_{i}"
 
     def get_new_fname(self, name_hint: str) -> str:
         if name_hint not in self.fs:
             return name_hint
-        i = 0
+        i = self._fname_counters.get(name_hint, 0)
         while f"{name_hint}_{i}" in self.fs:
             i += 1
+        self._fname_counters[name_hint] = i + 1
         return f"{name_hint}_{i}"
     
     def print_graph(self):
@@ -2191,8 +2282,9 @@ class ComputationFrame:
         }
         if isolated_vars:
             lines.append(", ".join(sorted(isolated_vars)))
+        ops = self.ops()  # computed once; rebuilding it per function node is wasteful
         for fname in self.sort_nodes(self.fnames):
-            op = self.ops()[fname]
+            op = ops[fname]
             input_name_to_vars = self.inp[fname] # input name -> {variables connected}
             output_name_to_vars = self.out[fname] # output name -> {variables connected}
             
@@ -2204,10 +2296,13 @@ class ComputationFrame:
             # sort the output names according to their order as returns
             ordered_output_names = sorted(output_names, key=lambda x: output_to_idx[x])
             # add the output names to the output variables in order to avoid
-            # confusion when outputs are present only partially in the graph
-            output_labels = copy.deepcopy(output_name_to_vars)
-            for output_name in output_labels.keys():
-                output_labels[output_name] = {f'{varname}' for varname in output_labels[output_name]}
+            # confusion when outputs are present only partially in the graph;
+            # the variable names are plain strings, so a fresh dict of fresh
+            # sets is enough (no need to deep-copy the adjacency)
+            output_labels = {
+                output_name: {f'{varname}' for varname in varnames}
+                for output_name, varnames in output_name_to_vars.items()
+            }
             lhs = ", ".join([('(' if len(output_labels[k]) > 1 else '') +\
                               " | ".join(output_labels[k]) +\
                               (')' if len(output_labels[k]) > 1 else '') + f"@{k}" 
@@ -2283,9 +2378,9 @@ class ComputationFrame:
                               )
         nodes = {**vnodes, **fnodes}
         edges = []
+        ops = self.ops()
         for src, dst, label in self.edges():
             display_label = label
-            ops = self.ops()
             if dst in ops and ops[dst].name == "__make_list__" and label == "elts":
                 display_label = "*elts"
             if verbose:
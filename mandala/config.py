@@ -10,6 +10,13 @@ class Config:
     mandala_path = get_mandala_path()
     module_name = "mandala"
     tests_module_name = "mandala.tests"
+    # optional bound on the number of entries held by each in-memory
+    # key-value cache; `None` means unbounded (the historical behavior)
+    cache_max_entries: Optional[int] = None
+    # optional age bound (in seconds since last use) on cache entries; when
+    # set, entries idle for longer are purged on each commit. `None` disables
+    # the purge
+    cache_max_age_seconds: Optional[float] = None
 
     try:
         import PIL
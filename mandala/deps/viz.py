@@ -1,5 +1,6 @@
 import textwrap
-from ..common_imports import *
+from typing import Dict, List, Tuple
+
 from ..viz import (
     Node as DotNode,
     Edge as DotEdge,
@@ -9,7 +9,7 @@ from .config import *
 from .utils import (
     parse_output_name,
 )
-from .utils import serialize, deserialize, get_content_hash
+from .utils import serialize, deserialize, get_content_hash, get_id_hash
 
 ################################################################################
 ### model
@@ -110,9 +110,12 @@ class Op:
         self.__structural__ = __structural__
         self.__allow_side_effects__ = __allow_side_effects__
         self.f = f
+        # cache the signature, which is expensive to introspect and needed on
+        # every call to the op
+        self._sig = inspect.signature(f) if f is not None else None
         #! make sure there's no overlap between the input and output names
         if f is not None:
-            input_names = list(inspect.signature(f).parameters.keys())
+            input_names = list(self._sig.parameters.keys())
             if output_names is not None:
                 assert not any(name in output_names for name in input_names), (
                     f"Output names clash with input names for op {name}."
@@ -131,6 +134,10 @@ class Op:
     def id(self) -> str:
         return self.name
 
+    @property
+    def sig(self) -> inspect.Signature:
+        return self._sig
+
     def _get_hashable_inputs(self, inputs: Dict[str, Ref]) -> Dict[str, Any]:
         return {k: v for k, v in inputs.items() if not isinstance(v.obj, _Ignore)}
 
@@ -146,7 +153,7 @@ class Op:
         obj = ({k: v.hid for k, v in hashable_inputs.items()}, self.name, self.version)
         if semantic_version is not None:
             obj = obj + (semantic_version,)
-        return get_content_hash(obj)
+        return get_id_hash(obj)
 
     def get_call_content_id(self, inputs: Dict[str, Ref],
                             semantic_version: Optional[str] = None) -> str:
@@ -154,7 +161,7 @@ class Op:
         obj = ({k: v.cid for k, v in hashable_inputs.items()}, self.name, self.version)
         if semantic_version is not None:
             obj = obj + (semantic_version,)
-        return get_content_hash(obj)
+        return get_id_hash(obj)
     
     def get_pre_call_id(self, inputs: Dict[str, Ref]) -> str:
         """
@@ -163,12 +170,12 @@ class Op:
         versions.
         """
         hashable_inputs = self._get_hashable_inputs(inputs)
-        return get_content_hash((self.name, {k: v.cid for k, v in hashable_inputs.items()}))
+        return get_id_hash((self.name, {k: v.cid for k, v in hashable_inputs.items()}))
 
     def get_output_history_ids(
         self, call_history_id: str, output_names: List[str]
     ) -> Dict[str, str]:
-        return {k: get_content_hash((call_history_id, k)) for k in output_names}
+        return {k: get_id_hash((call_history_id, k)) for k in output_names}
 
     def get_ordered_outputs(self, output_dict: Dict[str, Any]) -> Tuple[Any, ...]:
         if (
@@ -217,6 +224,18 @@ class Call:
         self.outputs = outputs
         self.semantic_version = semantic_version
         self.content_version = content_version
+        self._io_refs: Optional[Tuple[Ref, ...]] = None
+
+    @property
+    def io_refs(self) -> Tuple[Ref, ...]:
+        """
+        The input and output refs of the call as a single tuple, computed on
+        first use and cached (a call's inputs/outputs don't change after
+        construction).
+        """
+        if self._io_refs is None:
+            self._io_refs = tuple(self.inputs.values()) + tuple(self.outputs.values())
+        return self._io_refs
 
     def __repr__(self) -> str:
         return f"Call({self.op.name}, hid={self.hid[:3]}...)"
@@ -242,7 +261,7 @@ def wrap_atom(obj: Any, history_id: Optional[str] = None) -> AtomRef:
         return obj
     uid = get_content_hash(obj)
     if history_id is None:
-        history_id = get_content_hash(uid)
+        history_id = get_id_hash(uid)
     return AtomRef(cid=uid, hid=history_id, in_memory=True, obj=obj)
 
 
@@ -344,16 +363,16 @@ def __make_list__(**items: Any) -> MList[Any]:
     # items must be a dict with keys "elts_0", "elts_1", etc.
     elts = [items[f"elts_{i}"] for i in range(len(items))]
     return ListRef(
-        cid=get_content_hash([elt.cid for elt in elts]),
-        hid=get_content_hash([elt.hid for elt in elts]),
+        cid=get_id_hash([elt.cid for elt in elts]),
+        hid=get_id_hash([elt.hid for elt in elts]),
         in_memory=True,
         obj=elts,
     )
 
 def __make_dict__(**kwargs: Any) -> dict:
     return DictRef(
-        cid=get_content_hash(sorted([(k, v.cid) for k, v in kwargs.items()])),
-        hid=get_content_hash(sorted([(k, v.hid) for k, v in kwargs.items()])),
+        cid=get_id_hash(sorted([(k, v.cid) for k, v in kwargs.items()])),
+        hid=get_id_hash(sorted([(k, v.hid) for k, v in kwargs.items()])),
         in_memory=True,
         obj=kwargs,
     )
@@ -363,8 +382,8 @@ def __make_dict__(**kwargs: Any) -> dict:
 def __make_set__(**kwargs: Any) -> MSet[Any]:
     elts = [kwargs[f"elts_{i}"] for i in range(len(kwargs))]
     return SetRef(
-        cid=get_content_hash(sorted([elt.cid for elt in elts])),
-        hid=get_content_hash(sorted([elt.hid for elt in elts])),
+        cid=get_id_hash(sorted([elt.cid for elt in elts])),
+        hid=get_id_hash(sorted([elt.hid for elt in elts])),
         in_memory=True,
         obj=set(elts),
     )
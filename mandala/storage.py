@@ -5,7 +5,8 @@ import datetime
 from .model import *
 import sqlite3
 from .model import __make_list__, __list_getitem__, __make_dict__, __dict_getitem__, _Ignore, _NewArgDefault
-from .utils import dataframe_to_prettytable, parse_returns
+from .config import Config
+from .utils import dataframe_to_prettytable, parse_returns, serialize, deserialize
 from .viz import _get_colorized_diff
 from .deps.versioner import Versioner, CodeState
 from .deps.utils import get_dep_key_from_func, extract_func_obj
@@ -34,11 +35,17 @@ class Storage:
         self.calls = CachedCallStorage(persistent=self.call_storage)
         self.call_cache = self.calls.cache
 
+        # when `Config.cache_max_entries` is set, the key-value caches evict
+        # their least recently used clean entries past that bound
+        # atom values are serialized once in `save_ref`; the table stores
+        # those bytes as-is instead of pickling them a second time
         self.atoms = CachedDictStorage(
-            persistent=SQLiteDictStorage(self.db, table="atoms")
+            persistent=SQLiteDictStorage(self.db, table="atoms", raw=True),
+            max_entries=Config.cache_max_entries,
         )
         self.shapes = CachedDictStorage(
-            persistent=SQLiteDictStorage(self.db, table="shapes")
+            persistent=SQLiteDictStorage(self.db, table="shapes"),
+            max_entries=Config.cache_max_entries,
         )
         self.ops = CachedDictStorage(
             persistent=SQLiteDictStorage(self.db, table="ops")
@@ -85,6 +92,9 @@ class Storage:
         # a list of functions to call when the storage is exited
         # each function should have a single argument, the storage object
         self._exit_hooks = []
+        # nesting depth of `with storage:` blocks; only the outermost block
+        # sets up/tears down the context and commits on exit
+        self._context_depth = 0
 
     
     def conn(self) -> sqlite3.Connection:
@@ -111,18 +121,17 @@ class Storage:
         print(dataframe_to_prettytable(df))
 
     def preload_calls(self):
-        df = self.call_storage.get_df()
-        self.call_cache.df = df
-        self.call_cache.call_hids = set(df.index.levels[0].unique())
-    
+        # the df setter recomputes `call_hids` and `call_cids` in one pass
+        self.call_cache.df = self.call_storage.get_df()
+
     def preload_shapes(self):
-        self.shapes.cache = self.shapes.persistent.load_all()
-    
+        self.shapes.cache.update(self.shapes.persistent.load_all())
+
     def preload_ops(self):
-        self.ops.cache = self.ops.persistent.load_all()
+        self.ops.cache.update(self.ops.persistent.load_all())
 
     def preload_atoms(self):
-        self.atoms.cache = self.atoms.persistent.load_all()
+        self.atoms.cache.update(self.atoms.persistent.load_all())
     
     def preload(self, lazy: bool = True):
         self.preload_calls()
@@ -131,7 +140,41 @@ class Storage:
         if not lazy:
             self.preload_atoms()
 
+    def evict_caches(self):
+        """
+        Drop all in-memory cached data, clearing the existing containers in
+        place (a handful of C-level `clear` calls, no per-key deletes).
+
+        Note that this also discards any *uncommitted* data; call `commit`
+        first if you want to keep it.
+        """
+        self.atoms.clear()
+        self.shapes.clear()
+        self.ops.clear()
+        self.calls.clear()
+
+    @property
+    def is_clean(self) -> bool:
+        """
+        Whether there are no in-memory changes waiting to be committed.
+        """
+        return (
+            not self.atoms.dirty_keys
+            and not self.shapes.dirty_keys
+            and not self.ops.dirty_keys
+            and not self.calls.dirty_hids
+        )
+
     def commit(self):
+        if Config.cache_max_age_seconds is not None:
+            # age out entries the workload has moved past before flushing, so
+            # a long session's RSS tracks its working set rather than its history
+            self.atoms.purge_older_than(Config.cache_max_age_seconds)
+            self.shapes.purge_older_than(Config.cache_max_age_seconds)
+        if self.is_clean:
+            # nothing to flush; skip the transaction entirely (commit runs on
+            # every context exit, so this is the common case for read-only use)
+            return
         with self.conn() as conn:
             self.atoms.commit(conn=conn)
             self.shapes.commit(conn=conn)
@@ -174,6 +217,9 @@ class Storage:
             return
         if isinstance(ref, AtomRef):
             if ref.in_memory: #! ONLY save the atom if it is in memory
+                # serialize here, once: this snapshots the value under its cid
+                # (later mutations of `ref.obj` can't corrupt the store), and
+                # the SQLite layer persists these bytes as-is
                 self.atoms[ref.cid] = serialize(ref.obj)
             self.shapes[ref.hid] = ref.detached()
         elif isinstance(ref, ListRef):
@@ -208,6 +254,22 @@ class Storage:
         else:
             raise NotImplementedError
 
+    def mload_ref(self, hids: List[str], in_memory: bool = False) -> List[Ref]:
+        """
+        Like `load_ref` for a batch of refs: warm the shapes cache (and, when
+        the values themselves are needed, the atoms cache) with one query per
+        table, so the per-ref loads below don't each pay a DB round-trip.
+        """
+        shapes = self.shapes.get_many(hids)
+        if not in_memory:
+            atom_cids = {
+                shape.cid
+                for shape in shapes.values()
+                if isinstance(shape, AtomRef)
+            }
+            self.atoms.get_many(atom_cids)
+        return [self.load_ref(hid, in_memory=in_memory) for hid in hids]
+
     def _drop_ref_hid(self, hid: str, verify: bool = False):
         """
         Internal only function to drop a ref by its hid when it is not connected
@@ -233,13 +295,12 @@ class Storage:
         ### first, remove hids that are not connected to any calls
         orphans = self.get_orphans()
         logger.info(f"Cleaning up {len(orphans)} orphaned refs.")
-        for hid in orphans:
-            self._drop_ref_hid(hid)
+        # batched deletes: one statement per table instead of one per ref
+        self.shapes.drop_many(orphans)
         ### next, remove cids that are not connected to any refs
         unreferenced_cids = self.get_unreferenced_cids()
         logger.info(f"Cleaning up {len(unreferenced_cids)} unreferenced cids.")
-        for cid in unreferenced_cids:
-            self._drop_ref(cid)
+        self.atoms.drop_many(unreferenced_cids)
 
     ############################################################################
     ### calls interface
@@ -247,6 +308,19 @@ class Storage:
     def exists_call(self, hid: str) -> bool:
         return self.calls.exists(hid)
 
+    def calls_exist(self, hids: Iterable[str]) -> Set[str]:
+        """
+        Return the subset of the given call history_ids that exist in the
+        storage (cache or persistent), with a single DB query for the part
+        not answered by the cache.
+        """
+        hids = set(hids)
+        cached = hids & self.call_cache.call_hids
+        missing = hids - cached
+        if missing:
+            cached |= self.call_storage.exists_many(missing)
+        return cached
+
     def save_call(self, call: Call):
         """
         Save a *new* call to the storage. All inputs/outputs must be present.
@@ -259,41 +333,49 @@ class Storage:
             # save the op
             logger.debug(f"Caching new op {call.op.name}.")
             self.ops[call.op.name] = call.op.detached()
-        # (convert the iterator to a list to avoid double iteration)
-        io_refs = list(itertools.chain(call.inputs.values(), call.outputs.values()))
-        for v in io_refs:
+        for v in call.io_refs:
             self.save_ref(v)
         self.calls.save(call)
     
     def mget_call(self, hids: List[str], in_memory: bool) -> List[Call]:
-
-        def split_list(lst: List[Any], mask: List[bool]) -> Tuple[List[Any], List[Any]]:
-            return [x for x, m in zip(lst, mask) if m], [x for x, m in zip(lst, mask) if not m]
-        
-        def merge_lists(list_true: List[Any], list_false: List[Any], mask: List[bool]) -> List[Any]:
-            res = []
-            i, j = 0, 0
-            for m in mask:
-                if m:
-                    res.append(list_true[i])
-                    i += 1
-                else:
-                    res.append(list_false[j])
-                    j += 1
-            return res
-
-        mask = [self.call_cache.exists(hid) for hid in hids]
-        cache_part, db_part = split_list(hids, mask)
-        # cache_datas = [self.call_cache.get_data(hid) for hid in tqdm(cache_part)]
-        cache_datas = self.call_cache.mget_data(call_hids=cache_part)
-        db_datas = self.call_storage.mget_data(call_hids=db_part)
-        call_datas = merge_lists(cache_datas, db_datas, mask)
+        # partition the hids between cache and DB in a single pass, remembering
+        # where each one goes so the results can be put back in order
+        cache_part, db_part = [], []
+        mask = []
+        for hid in hids:
+            in_cache = self.call_cache.exists(hid)
+            mask.append(in_cache)
+            (cache_part if in_cache else db_part).append(hid)
+        cache_datas = iter(self.call_cache.mget_data(call_hids=cache_part))
+        db_datas = iter(self.call_storage.mget_data(call_hids=db_part))
+        call_datas = [next(cache_datas) if m else next(db_datas) for m in mask]
+        return self._get_calls_from_datas(call_datas, in_memory=in_memory)
+
+    def _get_calls_from_datas(
+        self, call_datas: List[Dict[str, Any]], in_memory: bool
+    ) -> List[Call]:
+        # warm the shapes cache for all refs in the batch with one query, so
+        # the per-ref loads below don't each pay a DB round-trip on cache miss
+        io_hids = set()
+        for call_data in call_datas:
+            io_hids.update(call_data["input_hids"].values())
+            io_hids.update(call_data["output_hids"].values())
+        self.shapes.get_many(io_hids)
 
         calls = []
         for call_data in call_datas:
             calls.append(self._get_call_from_data(call_data, in_memory=in_memory))
         return calls
-    
+
+    def get_op_calls(self, op_name: str, in_memory: bool = True) -> List[Call]:
+        """
+        Load all calls to the given op from the persistent storage with a
+        single query, instead of first listing their history_ids and then
+        fetching the same rows again.
+        """
+        call_datas = self.call_storage.mget_data_for_op(op_name)
+        return self._get_calls_from_datas(call_datas, in_memory=in_memory)
+
     def _get_call_from_data(self, call_data: Dict[str, Any], in_memory: bool) -> Call:
         op_name = call_data["op_name"]
         call = Call(
@@ -335,17 +417,17 @@ class Storage:
                 ref_hids=set(), call_hids=hids
             )
             hids |= dependent_call_hids
-        num_dropped_cache = 0
-        num_dropped_persistent = 0
-        for hid in hids:
-            if self.call_cache.exists(hid):
-                self.call_cache.drop(hid)
-                num_dropped_cache += 1
-        for hid in hids:
-            if self.call_storage.exists(hid):
-                self.call_storage.drop(hid)
-                num_dropped_persistent += 1
-        logger.info(f"Dropped {num_dropped_persistent} calls (and {num_dropped_cache} from cache).")
+        # answer existence from the cache where possible, with at most one DB
+        # query for the rest; deleting a hid that never reached the persistent
+        # storage (a dirty, cache-only call) is a harmless no-op there
+        existing_hids = self.calls_exist(hids)
+        cached_hids = hids & self.call_cache.call_hids
+        if cached_hids:
+            self.call_cache.drop_many(cached_hids)
+        if existing_hids:
+            # a single batched delete instead of one transaction per call
+            self.call_storage.drop_many(existing_hids)
+        logger.info(f"Dropped {len(existing_hids)} calls (and {len(cached_hids)} from cache).")
 
     ############################################################################
     ### provenance queries
@@ -379,10 +461,14 @@ class Storage:
         """
         if self.in_context():
             raise NotImplementedError("Method not supported while in a context.")
-        all_hids = set(self.shapes.persistent.keys())
-        df = self.call_storage.get_df()
-        hids_in_calls = df["ref_history_id"].unique()
-        return all_hids - set(hids_in_calls)
+        # push the set difference into SQL instead of materializing the full
+        # calls table in pandas just to read one column
+        with self.conn() as conn:
+            cursor = conn.execute(
+                f"SELECT key FROM {self.shapes.persistent.table} "
+                f"WHERE key NOT IN (SELECT ref_history_id FROM {self.call_storage.table_name})"
+            )
+            return {row[0] for row in cursor.fetchall()}
 
     def get_unreferenced_cids(self) -> Set[str]:
         """
@@ -390,11 +476,16 @@ class Storage:
         """
         if self.in_context():
             raise NotImplementedError("Method not supported while in a context.")
-        all_cids = set(self.atoms.persistent.keys())
-        df = self.call_storage.get_df()
-        cids_in_calls = df["ref_content_id"].unique()
-        cids_in_shapes = [shape.cid for shape in self.shapes.persistent.values()]
-        return (all_cids - set(cids_in_calls)) - set(cids_in_shapes)
+        with self.conn() as conn:
+            cursor = conn.execute(
+                f"SELECT key FROM {self.atoms.persistent.table} "
+                f"WHERE key NOT IN (SELECT ref_content_id FROM {self.call_storage.table_name})"
+            )
+            candidates = {row[0] for row in cursor.fetchall()}
+        # the cids referenced by shapes live inside serialized blobs, so this
+        # part of the difference stays in Python
+        cids_in_shapes = {shape.cid for shape in self.shapes.persistent.values()}
+        return candidates - cids_in_shapes
 
     ############################################################################
     ###
@@ -416,6 +507,8 @@ class Storage:
                 return ref.attached(obj=ref.obj)
         else:
             if inplace:
+                # deserialize a fresh copy per attach, so mutating one loaded
+                # value can't leak into later loads of the same ref
                 ref.obj = deserialize(self.atoms[ref.cid])
                 ref.in_memory = True
                 return None
@@ -727,17 +820,21 @@ class Storage:
         internally by the storage.
         """
         ### wrap the inputs
-        if not op.__structural__: logger.debug(f"Calling {op.name} with args {bound_arguments}.")
+        # hoisted out of the per-call logging statements: this is the hot path,
+        # and the f-strings below are only worth building when DEBUG is on
+        structural = op.__structural__
+        debug = (not structural) and logger.isEnabledFor(logging.DEBUG)
+        if debug: logger.debug(f"Calling {op.name} with args {bound_arguments}.")
 
-        must_version_call = self.versioned and not op.__structural__
+        must_version_call = self.versioned and not structural
 
         wrapped_inputs = {}
         input_calls = []
         for k, v in storage_inputs.items():
             wrapped_inputs[k], struct_calls = self.construct(tp=storage_tps[k], val=v)
             input_calls.extend(struct_calls)
-        if len(input_calls) > 0:
-            if not op.__structural__: logger.debug(f"Collected {len(input_calls)} calls for inputs.")
+        if debug and len(input_calls) > 0:
+            logger.debug(f"Collected {len(input_calls)} calls for inputs.")
 
         if must_version_call:
             suspended_trace_obj = self.cached_versioner.TracerCls.get_active_trace_obj()
@@ -751,29 +848,34 @@ class Storage:
             op=op,
             pre_call_uid=pre_call_id,
             inputs=wrapped_inputs,
-            code_state=self.guess_code_state() if must_version_call else None,
+            # reuse the code state maintained since `__enter__` (it is kept up
+            # to date by `apply_state_hypothesis` after each versioned call)
+            # instead of re-scanning the codebase on every call
+            code_state=(
+                (self.code_state if self.code_state is not None else self.guess_code_state())
+                if must_version_call
+                else None
+            ),
             versioner=self.cached_versioner if must_version_call else None,
             must_version=must_version_call,
         )
         tracer_option = (
-            self.cached_versioner.make_tracer() if must_version_call and not op.__structural__ else None
+            self.cached_versioner.make_tracer() if must_version_call and not structural else None
         )
 
         call_exists = (call_option is not None)
         if call_exists:
-            call_hid = call_option.hid
-            if not op.__structural__: logger.debug(f"Call to {op.name} with hid {call_hid} already exists.")
+            if debug: logger.debug(f"Call to {op.name} with hid {call_option.hid} already exists.")
             main_call = call_option
             return main_call.outputs, main_call, input_calls
 
         ### execute the call if it doesn't exist
-        if not op.__structural__: 
-            # logger.debug(f"Call to {op.name} with hid {call_hid} does not exist; executing.")
+        if debug:
             input_hids = {k: v.hid for k, v in wrapped_inputs.items()}
             logger.debug(f"HIDs of inputs: {input_hids}")
         # call the function
-        f, sig = op.f, inspect.signature(op.f)
-        if op.__structural__:
+        f, sig = op.f, op.sig
+        if structural:
             returns = f(**wrapped_inputs)
         else:
             # #! guard against side effects
@@ -1065,8 +1167,8 @@ class Storage:
                     source[k] = [source[k]]
             return ComputationFrame.from_vars(vars=source, storage=self)
         elif all(isinstance(elt, str) for elt in source):
-            # must be hids
-            refs = [self.load_ref(hid, in_memory=True) for hid in source]
+            # must be hids; load them as a batch to avoid a round-trip per hid
+            refs = self.mload_ref(list(source), in_memory=True)
             return ComputationFrame.from_refs(refs=refs, storage=self)
         else:
             raise ValueError("Invalid input to `cf`")
@@ -1077,7 +1179,7 @@ class Storage:
         __config__ = {} if __config__ is None else __config__
         kwarg_keys = set(kwargs.keys())
         bound_arguments, storage_inputs, storage_annotations = self.parse_args(
-            sig=inspect.signature(__op__.f),
+            sig=__op__.sig,
             args=args,
             kwargs=kwargs,
             apply_defaults=True,
@@ -1104,14 +1206,20 @@ class Storage:
             return ord_outputs
 
     def __enter__(self) -> "Storage":
-        Context.current_context = Context(storage=self)
-        if self.versioned:
-            versioner, code_state = self.sync_code()
-            self.cached_versioner = versioner
-            self.code_state = code_state
+        if self._context_depth == 0:
+            Context.current_context = Context(storage=self)
+            if self.versioned:
+                versioner, code_state = self.sync_code()
+                self.cached_versioner = versioner
+                self.code_state = code_state
+        self._context_depth += 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # nested blocks are no-ops; the outermost exit does the real teardown
+        self._context_depth -= 1
+        if self._context_depth > 0:
+            return
         Context.current_context = None
         try:
             self.commit()
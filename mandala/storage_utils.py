@@ -1,5 +1,4 @@
 from .common_imports import *
-from tqdm import tqdm
 import uuid
 from .utils import serialize, deserialize
 from .model import Call
@@ -109,20 +108,25 @@ class DictStorage(ABC):
 
 
 class SQLiteDictStorage(DictStorage):
-    def __init__(self, db: DBAdapter, table: str):
+    def __init__(self, db: DBAdapter, table: str, raw: bool = False):
         self.db = db
         self.table = table
+        # when `raw` is set, values are expected to already be serialized
+        # bytes and are stored/returned as-is instead of being pickled again
+        self.raw = raw
         with self.conn() as conn:
             conn.execute(
                 f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)"
             )
-    
+
     def conn(self) -> sqlite3.Connection:
         return self.db.conn()
-    
+
     def load_all(self) -> Dict[str, Any]:
         with self.conn() as conn:
             cursor = conn.execute(f"SELECT key, value FROM {self.table}")
+            if self.raw:
+                return {row[0]: row[1] for row in cursor.fetchall()}
             return {row[0]: deserialize(row[1]) for row in cursor.fetchall()}
 
     @transaction
@@ -131,7 +135,7 @@ class SQLiteDictStorage(DictStorage):
         result = cursor.fetchone()
         if result is None:
             raise KeyError(f"Key {key} not found")
-        return deserialize(result[0])
+        return result[0] if self.raw else deserialize(result[0])
 
     @transaction
     def set(
@@ -139,13 +143,56 @@ class SQLiteDictStorage(DictStorage):
     ) -> None:
         conn.execute(
             f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
-            (key, serialize(value)),
+            (key, value if self.raw else serialize(value)),
+        )
+
+    @transaction
+    def get_many(
+        self, keys: Iterable[str], conn: Optional[sqlite3.Connection] = None
+    ) -> Dict[str, Any]:
+        """
+        Load many keys in a single query; keys not present in the table are
+        simply absent from the result.
+        """
+        keys = list(keys)
+        cursor = conn.execute(
+            f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' for _ in keys)})",
+            keys,
+        )
+        if self.raw:
+            return {row[0]: row[1] for row in cursor.fetchall()}
+        return {row[0]: deserialize(row[1]) for row in cursor.fetchall()}
+
+    @transaction
+    def set_many(
+        self, items: Dict[str, Any], conn: Optional[sqlite3.Connection] = None
+    ) -> None:
+        """
+        Write many key/value pairs in a single statement.
+        """
+        if self.raw:
+            rows = list(items.items())
+        else:
+            rows = [(key, serialize(value)) for key, value in items.items()]
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", rows
         )
 
     @transaction
     def drop(self, key: str, conn: Optional[sqlite3.Connection] = None) -> None:
         conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
 
+    @transaction
+    def drop_many(
+        self, keys: Iterable[str], conn: Optional[sqlite3.Connection] = None
+    ) -> None:
+        """
+        Delete many keys in a single statement/transaction.
+        """
+        conn.executemany(
+            f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys]
+        )
+
     @transaction
     def exists(self, key: str, conn: Optional[sqlite3.Connection] = None) -> bool:
         cursor = conn.execute(
@@ -166,11 +213,51 @@ class SQLiteDictStorage(DictStorage):
 
 
 class CachedDictStorage(DictStorage):
-    def __init__(self, persistent: DictStorage):
+    def __init__(
+        self, persistent: DictStorage, max_entries: Optional[int] = None
+    ):
         self.persistent = persistent
-        self.cache: Dict[str, Any] = {}
+        # an OrderedDict so that, when `max_entries` is set, we can evict the
+        # least recently used entries; with the default `max_entries=None` the
+        # cache is unbounded and behaves like a plain dict
+        self.cache: Dict[str, Any] = OrderedDict()
+        self.max_entries = max_entries
         self.dirty_keys: Set[str] = set()
-    
+        # keys confirmed to exist in the persistent storage; lets repeated
+        # existence checks (e.g. one per saved ref/call) skip the DB query
+        self._known_keys: Set[str] = set()
+        # when each key was last read or written (`time.monotonic()`); used by
+        # `purge_older_than` to drop entries the workload has moved past
+        self._last_used: Dict[str, float] = {}
+
+    def _evict_lru(self) -> None:
+        if self.max_entries is None or len(self.cache) <= self.max_entries:
+            return
+        # evict clean entries oldest-first; dirty entries are pinned until
+        # `commit` flushes them to the persistent storage
+        for key in list(self.cache):
+            if len(self.cache) <= self.max_entries:
+                break
+            if key not in self.dirty_keys:
+                del self.cache[key]
+                self._last_used.pop(key, None)
+
+    def purge_older_than(self, seconds: float) -> None:
+        """
+        Evict clean entries that were last used more than `seconds` ago, so
+        the cache does not keep data hot long after the workload has shifted.
+        Dirty entries are pinned until `commit` flushes them.
+        """
+        cutoff = time.monotonic() - seconds
+        stale = [
+            key
+            for key, last_used in self._last_used.items()
+            if last_used < cutoff and key not in self.dirty_keys
+        ]
+        for key in stale:
+            self.cache.pop(key, None)
+            del self._last_used[key]
+
     def load_all(self) -> Dict[str, Any]:
         return self.persistent.load_all()
     
@@ -178,39 +265,94 @@ class CachedDictStorage(DictStorage):
         return len(self.cache)
 
     def get(self, key: str) -> Any:
+        self._last_used[key] = time.monotonic()
         if key in self.cache:
+            if self.max_entries is not None:
+                self.cache.move_to_end(key)
             return self.cache[key]
         else:
             value = self.persistent.get(key)
             self.cache[key] = value
+            self._evict_lru()
             return value
 
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Like `get` for a batch of keys: serve what we can from the cache and
+        fetch the rest from the persistent storage in one query, caching the
+        results. Keys not found anywhere are absent from the result.
+        """
+        res = {}
+        missing = []
+        track_lru = self.max_entries is not None
+        now = time.monotonic()
+        for key in keys:
+            self._last_used[key] = now
+            if key in self.cache:
+                if track_lru:
+                    self.cache.move_to_end(key)
+                res[key] = self.cache[key]
+            else:
+                missing.append(key)
+        if missing:
+            fetched = self.persistent.get_many(missing)
+            self.cache.update(fetched)
+            self._evict_lru()
+            res.update(fetched)
+        return res
+
     def set(self, key: str, value: Any) -> None:
         self.cache[key] = value
+        self._last_used[key] = time.monotonic()
+        if self.max_entries is not None:
+            self.cache.move_to_end(key)
         self.dirty_keys.add(key)
+        self._evict_lru()
 
     def commit(self, conn: Optional[sqlite3.Connection] = None) -> None:
-        for key in self.dirty_keys:
-            self.persistent.set(key, self.cache[key], conn=conn)
+        # snapshot the dirty entries in one pass and write them as one batch
+        # instead of issuing a statement per key
+        self.persistent.set_many(
+            {key: self.cache[key] for key in self.dirty_keys}, conn=conn
+        )
         self.dirty_keys.clear()
+        # the entries just flushed are no longer pinned, so enforce the bound
+        # now — a write burst may have pushed the cache far past `max_entries`
+        self._evict_lru()
     
     def clear(self) -> None:
         self.cache.clear()
         self.dirty_keys.clear()
+        self._last_used.clear()
 
     def drop(self, key: str) -> None:
         if key in self.cache:
             del self.cache[key]
         if key in self.dirty_keys:
             self.dirty_keys.remove(key) # when we `drop`, we forget this key ever existed
+        self._known_keys.discard(key)
+        self._last_used.pop(key, None)
         self.persistent.drop(key)
 
+    def drop_many(self, keys: Iterable[str]) -> None:
+        """
+        Like `drop` for a batch of keys, paying a single persistent delete.
+        """
+        keys = list(keys)
+        for key in keys:
+            self.cache.pop(key, None)
+            self.dirty_keys.discard(key) # when we `drop`, we forget this key ever existed
+            self._known_keys.discard(key)
+            self._last_used.pop(key, None)
+        self.persistent.drop_many(keys)
+
     def exists(self, key: str) -> bool:
-        if key in self.cache:
+        if key in self.cache or key in self._known_keys:
             return True
-        else:
-            res = self.persistent.exists(key)
-            return res
+        res = self.persistent.exists(key)
+        if res:
+            self._known_keys.add(key)
+        return res
 
 
 class InMemCallStorage:
@@ -227,85 +369,151 @@ class InMemCallStorage:
     ]
 
     def __init__(self, df: Optional[pd.DataFrame] = None):
+        # rows buffered by `save` but not yet merged into `_df`; inserting
+        # rows one by one with `.loc` rebuilds the MultiIndex per row, so we
+        # accumulate them here and flush in bulk the next time `df` is read
+        self._pending_rows: List[Tuple[Tuple[str, str], Tuple]] = []
         if df is not None:
-            self.df = df
+            self._df = df
             # for faster lookups
             self.call_hids = set(df.index.levels[0].unique())
+            self.call_cids = set(df["call_content_id"].unique())
         else:
-            self.df = pd.DataFrame(columns=InMemCallStorage.COLUMNS).set_index(
+            self._df = pd.DataFrame(columns=InMemCallStorage.COLUMNS).set_index(
                 ["call_history_id", "name"]
             )
             self.call_hids = set()
-        
+            self.call_cids = set()
+
+    @property
+    def df(self) -> pd.DataFrame:
+        self._flush()
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame):
+        self._pending_rows = []
+        self._df = value
+        self.call_hids = set(value.index.levels[0].unique())
+        self.call_cids = set(value["call_content_id"].unique())
+
+    def _flush(self):
+        if not self._pending_rows:
+            return
+        index = pd.MultiIndex.from_tuples(
+            [idx for idx, _ in self._pending_rows],
+            names=["call_history_id", "name"],
+        )
+        new_df = pd.DataFrame(
+            [row for _, row in self._pending_rows],
+            columns=InMemCallStorage.COLUMNS[2:],
+            index=index,
+        )
+        if len(self._df) == 0:
+            self._df = new_df
+        else:
+            self._df = pd.concat([self._df, new_df])
+        self._pending_rows = []
+
     def __len__(self) -> int:
-        return self.df.index.get_level_values(0).nunique()
+        return len(self.call_hids)
+
+    def clear(self):
+        """
+        Evict everything, resetting the existing containers in place (so that
+        aliases to this storage held elsewhere remain valid).
+        """
+        self._pending_rows.clear()
+        self._df = pd.DataFrame(columns=InMemCallStorage.COLUMNS).set_index(
+            ["call_history_id", "name"]
+        )
+        self.call_hids.clear()
+        self.call_cids.clear()
 
     def save(self, call: Call):
-        # if call.hid in self.df.index.levels[0]:
         if call.hid in self.call_hids:
             return
+        call_hid, call_cid = call.hid, call.cid
+        op_name = call.op.name
+        semantic_version, content_version = call.semantic_version, call.content_version
         for k, v in call.inputs.items():
-            self.df.loc[(call.hid, k), :] = ("in", call.cid, v.cid, v.hid, call.op.name, call.semantic_version, call.content_version)
+            self._pending_rows.append(
+                ((call_hid, k), ("in", call_cid, v.cid, v.hid, op_name, semantic_version, content_version))
+            )
         for k, v in call.outputs.items():
-            self.df.loc[(call.hid, k), :] = (
-                "out",
-                call.cid,
-                v.cid,
-                v.hid,
-                call.op.name,
-                call.semantic_version,
-                call.content_version,
+            self._pending_rows.append(
+                ((call_hid, k), ("out", call_cid, v.cid, v.hid, op_name, semantic_version, content_version))
             )
-        self.call_hids.add(call.hid)
+        self.call_hids.add(call_hid)
+        self.call_cids.add(call_cid)
 
     def drop(self, hid: str):
         """
         Remove all rows referencing the call with the given history_id.
         """
-        if hid not in self.df.index.levels[0]:
+        if hid not in self.call_hids:
             raise ValueError(f"Call with history_id {hid} does not exist")
-        # self.df.drop(index=hid, level=0, inplace=True)
-        self.df = self.df.drop(index=hid, level=0)
+        df = self.df  # flushes any pending rows
+        df = df.drop(index=hid, level=0)
         #! this step is crucial, because otherwise the old `hid` remains in the index
-        self.df.index = self.df.index.remove_unused_levels()
+        df.index = df.index.remove_unused_levels()
+        self._df = df
         self.call_hids.remove(hid)
+        # content ids may be shared between calls, so recompute the set
+        self.call_cids = set(df["call_content_id"].unique())
+
+    def drop_many(self, hids: Iterable[str]):
+        """
+        Remove all rows referencing the calls with the given history_ids,
+        paying the DataFrame drop/reindex cost once instead of once per call.
+        """
+        hids = set(hids)
+        missing = hids - self.call_hids
+        if missing:
+            raise ValueError(f"Calls with history_ids {missing} do not exist")
+        df = self.df  # flushes any pending rows
+        df = df.drop(index=list(hids), level=0)
+        #! this step is crucial, because otherwise the old hids remain in the index
+        df.index = df.index.remove_unused_levels()
+        self._df = df
+        self.call_hids -= hids
+        # content ids may be shared between calls, so recompute the set
+        self.call_cids = set(df["call_content_id"].unique())
 
     def exists(self, hid: str) -> bool:
-        # return call_history_id in self.df.index.levels[0]
         return hid in self.call_hids
-    
+
     def exists_content(self, cid: str) -> bool:
-        return cid in self.df.call_content_id.unique()
+        return cid in self.call_cids
     
     def mget_data(self, call_hids: List[str]) -> List[Dict[str, Any]]:
         idx = pd.IndexSlice
         filtered_df = self.df.loc[idx[call_hids, :], :]
-        grouped = filtered_df.groupby(level=0)
-        groups = {key: value for key, value in grouped}
+        # a single pass over the rows, mirroring `SQLiteCallStorage.mget_data`;
+        # this avoids a groupby and the materialization of a sub-DataFrame and
+        # records dict per call
         res_dict = {}
-        for hid, group_df in tqdm(groups.items(), delay=5):
-            rows = group_df.reset_index().to_dict(orient="records")
-            input_hids, output_hids = {}, {}
-            input_cids, output_cids = {}, {}
-            for row in rows:
-                if row["direction"] == "in":
-                    input_hids[row["name"]] = row["ref_history_id"]
-                    input_cids[row["name"]] = row["ref_content_id"]
-                else:
-                    output_hids[row["name"]] = row["ref_history_id"]
-                    output_cids[row["name"]] = row["ref_content_id"]
-            op_name = rows[0]["op"]
-            res_dict[hid] = {
-                "op_name": op_name,
-                "cid": rows[0]["call_content_id"],
-                "hid": hid,
-                "input_hids": input_hids,
-                "output_hids": output_hids,
-                "input_cids": input_cids,
-                "output_cids": output_cids,
-                "semantic_version": rows[0]["semantic_version"],
-                "content_version": rows[0]["content_version"],
-            }
+        for row in filtered_df.itertuples():
+            hid, name = row.Index
+            call_data = res_dict.get(hid)
+            if call_data is None:
+                call_data = res_dict[hid] = {
+                    "op_name": row.op,
+                    "cid": row.call_content_id,
+                    "hid": hid,
+                    "input_hids": {},
+                    "output_hids": {},
+                    "input_cids": {},
+                    "output_cids": {},
+                    "semantic_version": row.semantic_version,
+                    "content_version": row.content_version,
+                }
+            if row.direction == "in":
+                call_data["input_hids"][name] = row.ref_history_id
+                call_data["input_cids"][name] = row.ref_content_id
+            else:
+                call_data["output_hids"][name] = row.ref_history_id
+                call_data["output_cids"][name] = row.ref_content_id
         return [res_dict[hid] for hid in call_hids]
 
     def get_data(self, call_history_id: str) -> Dict[str, Any]:
@@ -322,34 +530,28 @@ class InMemCallStorage:
         return self.get_data(hid)
 
     def get_creator_hids(self, ref_hids: Iterable[str]) -> Set[str]:
-        #! slow
-        call_history_ids = (
-            self.df.query('ref_history_id in @ref_hids and direction == "out"')
-            .index.get_level_values(0)
-            .unique()
+        mask = self.df["ref_history_id"].isin(set(ref_hids)) & (
+            self.df["direction"] == "out"
         )
-        return set(call_history_ids)
+        return set(self.df.index.get_level_values(0)[mask.values].unique())
 
     def get_consumer_hids(self, ref_hids: Iterable[str]) -> Set[str]:
-        #! slow
-        call_history_ids = (
-            self.df.query('ref_history_id in @ref_hids and direction == "in"')
-            .index.get_level_values(0)
-            .unique()
+        mask = self.df["ref_history_id"].isin(set(ref_hids)) & (
+            self.df["direction"] == "in"
         )
-        return set(call_history_ids)
+        return set(self.df.index.get_level_values(0)[mask.values].unique())
 
     def get_input_hids(self, call_hids: Iterable[str]) -> Set[str]:
-        ref_hids = self.df.query(
-            'call_history_id in @call_hids and direction == "in"'
-        ).ref_history_id.unique()
-        return set(ref_hids)
+        mask = self.df.index.get_level_values(0).isin(set(call_hids)) & (
+            self.df["direction"] == "in"
+        ).values
+        return set(self.df["ref_history_id"].values[mask])
 
     def get_output_hids(self, call_hids: Iterable[str]) -> Set[str]:
-        ref_hids = self.df.query(
-            'call_history_id in @call_hids and direction == "out"'
-        ).ref_history_id.unique()
-        return set(ref_hids)
+        mask = self.df.index.get_level_values(0).isin(set(call_hids)) & (
+            self.df["direction"] == "out"
+        ).values
+        return set(self.df["ref_history_id"].values[mask])
 
     def get_dependencies(
         self, ref_hids: Iterable[str], call_hids: Iterable[str]
@@ -402,7 +604,10 @@ class SQLiteCallStorage:
                 "call_content_id TEXT, ref_content_id TEXT, ref_history_id TEXT, op TEXT, semantic_version TEXT, "
                 "content_version TEXT, PRIMARY KEY (call_history_id, name))"
             )
-    
+        # cached result of `get_df`; invalidated by every write through this
+        # object (all writes go through `save`/`drop`/`drop_many`)
+        self._df_cache: Optional[pd.DataFrame] = None
+
     def conn(self) -> sqlite3.Connection:
         return self.db.conn()
 
@@ -411,10 +616,19 @@ class SQLiteCallStorage:
     def get_df(self, conn: Optional[sqlite3.Connection] = None) -> pd.DataFrame:
         """
         Load the full table into a DataFrame.
+
+        Reuses the previous result until a write goes through this object,
+        which avoids re-reading and re-indexing the entire table on every
+        provenance traversal.
         """
-        return pd.read_sql(f"SELECT * FROM {self.table_name}", conn).set_index(
+        if self._df_cache is not None:
+            return self._df_cache.copy()
+        df = pd.read_sql(f"SELECT * FROM {self.table_name}", conn).set_index(
             ["call_history_id", "name"]
         )
+        self._df_cache = df
+        # return a copy so callers can mutate the result without corrupting the cache
+        return df.copy()
 
     @transaction
     def execute_df(
@@ -426,6 +640,7 @@ class SQLiteCallStorage:
     def save(
         self, call_data: Dict[str, Any], conn: Optional[sqlite3.Connection] = None
     ):
+        self._df_cache = None
         semantic_version = call_data["semantic_version"]
         content_version = call_data["content_version"]
         op_name = call_data["op_name"]
@@ -446,8 +661,19 @@ class SQLiteCallStorage:
 
     @transaction
     def drop(self, hid: str, conn: Optional[sqlite3.Connection] = None):
+        self._df_cache = None
         conn.execute(f"DELETE FROM {self.table_name} WHERE call_history_id = ?", (hid,))
 
+    @transaction
+    def drop_many(
+        self, hids: Iterable[str], conn: Optional[sqlite3.Connection] = None
+    ):
+        self._df_cache = None
+        conn.executemany(
+            f"DELETE FROM {self.table_name} WHERE call_history_id = ?",
+            [(hid,) for hid in hids],
+        )
+
     @transaction
     def exists(
         self, call_history_id: str, conn: Optional[sqlite3.Connection] = None
@@ -459,6 +685,22 @@ class SQLiteCallStorage:
         count = cursor.fetchone()[0]
         return count > 0
     
+    @transaction
+    def exists_many(
+        self, call_hids: Iterable[str], conn: Optional[sqlite3.Connection] = None
+    ) -> Set[str]:
+        """
+        Return the subset of the given history_ids that exist in the table,
+        using a single query.
+        """
+        call_hids = list(call_hids)
+        cursor = conn.execute(
+            f"SELECT DISTINCT call_history_id FROM {self.table_name} "
+            f"WHERE call_history_id IN ({','.join('?' for _ in call_hids)})",
+            call_hids,
+        )
+        return {row[0] for row in cursor.fetchall()}
+
     @transaction
     def exists_content(
         self, cid: str, conn: Optional[sqlite3.Connection] = None
@@ -491,13 +733,21 @@ class SQLiteCallStorage:
             f"SELECT * FROM {self.table_name} WHERE call_history_id IN ({','.join('?' for _ in call_hids)})",
             call_hids,
         )
-        rows = cursor.fetchall()
+        call_data = self._parse_call_rows(cursor.fetchall())
+        return [call_data[hid] for hid in call_hids]
+
+    @staticmethod
+    def _parse_call_rows(rows: List[Tuple]) -> Dict[str, Dict[str, Any]]:
+        """
+        Group raw table rows (one per call input/output) into per-call data
+        dicts, keyed by call history_id.
+        """
         call_data = {}
         for row in rows:
             hid = row[0]
             if hid not in call_data:
                 call_data[hid] = {
-                    "op_name": row[6], "cid": row[3], "hid": hid, "input_hids": {}, "output_hids": {}, "input_cids": {}, "output_cids": {}, 
+                    "op_name": row[6], "cid": row[3], "hid": hid, "input_hids": {}, "output_hids": {}, "input_cids": {}, "output_cids": {},
                     "semantic_version": row[7], "content_version": row[8]
                     }
             if row[2] == "in":
@@ -506,7 +756,20 @@ class SQLiteCallStorage:
             else:
                 call_data[hid]["output_hids"][row[1]] = row[5]
                 call_data[hid]["output_cids"][row[1]] = row[4]
-        return [call_data[hid] for hid in call_hids]
+        return call_data
+
+    @transaction
+    def mget_data_for_op(
+        self, op_name: str, conn: Optional[sqlite3.Connection] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the data of all `Call` objects for the given op in a single query,
+        without first materializing the list of their history_ids.
+        """
+        cursor = conn.execute(
+            f"SELECT * FROM {self.table_name} WHERE op = ?", (op_name,)
+        )
+        return list(self._parse_call_rows(cursor.fetchall()).values())
 
     @transaction
     def get_data(
@@ -652,11 +915,14 @@ class CachedCallStorage:
     def commit(self, conn: Optional[sqlite3.Connection] = None):
         if conn is None:
             conn = self.persistent.conn()
-        # with conn:
-        for hid in self.dirty_hids:
-            self.persistent.save(self.cache.get_data(hid), conn=conn)
+        # gather the data of all dirty calls in one bulk read of the in-memory
+        # frame, rather than one indexing pass per call
+        for call_data in self.cache.mget_data(sorted(self.dirty_hids)):
+            self.persistent.save(call_data, conn=conn)
         self.dirty_hids.clear()
     
     def clear(self):
-        self.cache = InMemCallStorage()
+        # clear the existing cache in place rather than replacing it, so that
+        # aliases to it (e.g. `Storage.call_cache`) keep pointing at live data
+        self.cache.clear()
         self.dirty_hids.clear()
@@ -131,3 +131,53 @@ def test_lists():
     with storage:
         elts = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
         squares = chunked_square(elts)
+
+
+def test_call_df_cache_invalidation():
+    # regression test: dropping the most recent call and saving a new one with
+    # the same number of rows must not serve the dropped call from the cached
+    # call table
+    storage = Storage()
+
+    @op
+    def inc(x: int) -> int:
+        return x + 1
+
+    with storage:
+        inc(1)
+
+    # warm the cached call table, then drop the only call
+    df = storage.call_storage.get_df()
+    dropped_hid = df.index.get_level_values("call_history_id").unique()[0]
+    storage.drop_calls([dropped_hid], delete_dependents=True)
+
+    with storage:
+        inc(2)  # same shape as the dropped call
+
+    hids = set(storage.call_storage.get_df().index.get_level_values("call_history_id"))
+    assert dropped_hid not in hids
+    assert len(hids) == 1
+
+
+def test_cache_max_entries():
+    from mandala.config import Config
+
+    # a write burst pins dirty entries past the cap; after the commit at
+    # context exit, the bound must be enforced again
+    Config.cache_max_entries = 10
+    try:
+        storage = Storage()
+
+        @op
+        def inc(x: int) -> int:
+            return x + 1
+
+        with storage:
+            refs = [inc(i) for i in range(50)]
+
+        assert len(storage.atoms.cache) <= 10
+        assert len(storage.shapes.cache) <= 10
+        # evicted values are still reachable through the persistent storage
+        assert storage.unwrap(storage.load_ref(refs[0].hid)) == 1
+    finally:
+        Config.cache_max_entries = None
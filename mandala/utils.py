@@ -61,6 +61,48 @@ def get_content_hash(obj: Any) -> str:
     return result
 
 
+def _encode_for_id_hash(obj: Any) -> bytes:
+    """
+    Canonical, self-delimiting byte encoding of the small id structures
+    (nested tuples/lists/dicts of strings, ints and Nones). Raises `TypeError`
+    on anything else.
+    """
+    if obj is None:
+        return b"N"
+    tp = type(obj)
+    if tp is str:
+        data = obj.encode()
+        return b"s%d:%s" % (len(data), data)
+    if tp is int:
+        return b"i%d" % obj
+    if tp is tuple or tp is list:
+        return b"t%d:%s" % (len(obj), b"".join(map(_encode_for_id_hash, obj)))
+    if tp is dict:
+        return b"d%d:%s" % (
+            len(obj),
+            b"".join(
+                _encode_for_id_hash(k) + _encode_for_id_hash(v)
+                for k, v in sorted(obj.items())
+            ),
+        )
+    raise TypeError(f"Cannot canonically encode object of type {tp}")
+
+
+def get_id_hash(obj: Any) -> str:
+    """
+    Fast deterministic hash for the structures the ids of calls and outputs
+    are derived from: nested tuples/lists/dicts of (mostly) strings. These are
+    hashed on every call, memoized or not, so we skip the generic pickle-based
+    `get_content_hash` in favor of a direct canonical encoding fed to blake2b.
+    Falls back to `get_content_hash` for anything the encoding doesn't cover.
+    """
+    try:
+        encoding = _encode_for_id_hash(obj)
+    except TypeError:
+        return get_content_hash(obj)
+    return hashlib.blake2b(encoding, digest_size=16).hexdigest()
+
+
 def dump_output_name(index: int, output_names: Optional[List[str]] = None) -> str:
     sess.d()
     if output_names is not None and index < len(output_names):
@@ -2,26 +2,28 @@
 A minimal OOP wrapper around dot/graphviz
 """
 import difflib
-from .common_imports import *
-from .config import Config
-import tempfile
+import functools
+import io
 import subprocess
-import webbrowser
-from typing import Literal
-from graphviz import Source
-from IPython import display
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Literal, Optional, Set, Tuple
 
-if Config.has_pil:
-    from PIL import Image
+import numpy as np
+
+from .common_imports import logger
 
 
 class Color:
     def __init__(self, r: int, g: int, b: int, opacity: float = 1.0):
         self.r, self.g, self.b, self.opacity = r, g, b, opacity
+        # colors are immutable value objects interpolated into every rendered
+        # node/edge/cell, so format the hex string once up front
+        self._s = f"#{r:02x}{g:02x}{b:02x}{int(opacity * 255):02x}"
 
     def __str__(self) -> str:
-        opacity_int = int(self.opacity * 255)
-        return f"#{self.r:02x}{self.g:02x}{self.b:02x}{opacity_int:02x}"
+        return self._s
 
 
 SOLARIZED_LIGHT = {
@@ -44,20 +46,26 @@ SOLARIZED_LIGHT = {
 }
 
 
+# built once: _colorize runs per line of (potentially multi-thousand-line)
+# diffs, so the escape prefixes are precomputed rather than re-derived from
+# color codes on every call
+_ANSI_PREFIX = {
+    "red": "\033[31m",
+    "green": "\033[32m",
+    "blue": "\033[34m",
+    "yellow": "\033[33m",
+    "magenta": "\033[35m",
+    "cyan": "\033[36m",
+    "white": "\033[37m",
+}
+_ANSI_RESET = "\033[0m"
+
+
 def _colorize(text: str, color: str) -> str:
     """
     Return `text` with ANSI color codes for `color` added.
     """
-    colors = {
-        "red": 31,
-        "green": 32,
-        "blue": 34,
-        "yellow": 33,
-        "magenta": 35,
-        "cyan": 36,
-        "white": 37,
-    }
-    return f"\033[{colors[color]}m{text}\033[0m"
+    return f"{_ANSI_PREFIX[color]}{text}{_ANSI_RESET}"
 
 
 def _get_diff(current: str, new: str) -> str:
@@ -80,16 +88,18 @@ def _get_diff(current: str, new: str) -> str:
     return "\n".join(lines)
 
 
-def _get_colorized_diff(
+def _iter_colorized_diff(
     current: str, new: str, style: str = "multiline", context_lines: int = 2,
     colorize: bool = True
-) -> str:
+) -> Iterable[str]:
     """
-    Return a line-by-line colorized diff of the changes between `current` and
-    `new`. each line removed from `current` is colored red, and each line added
-    to `new` is colored green.
+    Yield the lines of a colorized diff of the changes between `current` and
+    `new` one by one, so callers that print or log don't have to hold the
+    whole diff in memory.
     """
-    lines = []
+    # dispatch on the first character (with _colorize inlined) instead of
+    # paying up to five startswith calls per line
+    red, green = _ANSI_PREFIX["red"], _ANSI_PREFIX["green"]
     for line in difflib.unified_diff(
         current.splitlines(),
         new.splitlines(),
@@ -97,22 +107,37 @@ def _get_colorized_diff(
         # fromfile="current", tofile="new"
         lineterm="",
     ):
-        if line.startswith("@@") or line.startswith("+++") or line.startswith("---"):
+        c = line[:1]
+        if c == "@" or line.startswith("+++") or line.startswith("---"):
             continue
-        if line.startswith("-"):
+        if c == "-":
             if style == "inline":
                 line = line[1:]
             if colorize:
-                line = _colorize(line, "red")
-            lines.append(line)
-        elif line.startswith("+"):
+                line = f"{red}{line}{_ANSI_RESET}"
+            yield line
+        elif c == "+":
             if style == "inline":
                 line = line[1:]
             if colorize:
-                line = _colorize(line, "green")
-            lines.append(line)
+                line = f"{green}{line}{_ANSI_RESET}"
+            yield line
         else:
-            lines.append(line)
+            yield line
+
+
+def _get_colorized_diff(
+    current: str, new: str, style: str = "multiline", context_lines: int = 2,
+    colorize: bool = True
+) -> str:
+    """
+    Return a line-by-line colorized diff of the changes between `current` and
+    `new`. each line removed from `current` is colored red, and each line added
+    to `new` is colored green.
+    """
+    lines = _iter_colorized_diff(
+        current, new, style=style, context_lines=context_lines, colorize=colorize
+    )
     if style == "multiline":
         return "\n".join(lines)
     elif style == "inline":
@@ -142,41 +167,58 @@ class Cell:
         self.border_color = border_color
         self.font_color = font_color
         self.bold = bold
+        # everything up to COLSPAN is fixed at construction, so render it
+        # once; only `colspan` may change afterwards (the HTML builder
+        # broadcasts it). portless cells omit the PORT attribute entirely —
+        # previously they emitted a bogus PORT="None"
+        port_part = "" if port is None else f' PORT="{port}"'
+        self._td_prefix = (
+            f'<TD ALIGN="CENTER"{port_part} COLOR="{border_color}" '
+            f'BGCOLOR="{bgcolor}" COLSPAN="'
+        )
+        self._font_prefix = (
+            None if font_color is None else f'<FONT COLOR="{font_color}">'
+        )
 
     def to_dot_string(self) -> str:
         text_str = self.text
         if self.bold:
             text_str = f"<B>{text_str}</B>"
-        if self.font_color is not None:
-            text_str = f'<FONT COLOR="{self.font_color}">{text_str}</FONT>'
-        return f'<TD ALIGN="CENTER" PORT="{self.port}" COLOR="{self.border_color}" BGCOLOR="{self.bgcolor}" COLSPAN="{self.colspan}">{text_str}</TD>'
+        if self._font_prefix is not None:
+            text_str = f"{self._font_prefix}{text_str}</FONT>"
+        return f'{self._td_prefix}{self.colspan}">{text_str}</TD>'
 
 
 class HTMLBuilder:
     def __init__(self):
         self.rows: List[List[Cell]] = []
+        # distinct row widths, maintained incrementally so rendering doesn't
+        # rescan every row just to compute the colspan broadcast
+        self._row_sizes: Set[int] = set()
 
     def add_row(self, cells: List[Cell]):
         self.rows.append(cells)
+        self._row_sizes.add(len(cells))
 
     def to_html_like_label(self) -> str:
-        start = '<TABLE ALIGN="CENTER" BORDER="0" CELLBORDER="1" CELLSPACING="0" >'
-        end = "</TABLE>"
         # broadcast colspan
-        row_sizes = set([len(row) for row in self.rows])
-        lcm = np.lcm.reduce(list(row_sizes))
+        lcm = np.lcm.reduce(list(self._row_sizes))
         for row in self.rows:
             elt_colspan = lcm // len(row)
             for cell in row:
                 cell.colspan = elt_colspan
 
-        rows = []
+        # stream the label into one growing buffer instead of collecting
+        # per-cell fragments in a list and copying them around
+        buf = io.StringIO()
+        buf.write('<TABLE ALIGN="CENTER" BORDER="0" CELLBORDER="1" CELLSPACING="0" >')
         for row in self.rows:
-            rows.append("<TR>")
+            buf.write("<TR>")
             for cell in row:
-                rows.append(cell.to_dot_string())
-            rows.append("</TR>")
-        return start + "".join(rows) + end
+                buf.write(cell.to_dot_string())
+            buf.write("</TR>")
+        buf.write("</TABLE>")
+        return buf.getvalue()
 
 
 class _Node:
@@ -196,13 +238,25 @@ class _Node:
         self.internal_name = internal_name
         self.label = label
         self.color = color
+        self._color_str = str(color)
         self.shape = shape
         self.additional_lines = additional_lines
 
     def to_dot_string(self) -> str:
         text = self.label if self.additional_lines is None else f"{self.label}\\n{self.additional_lines}"
         dot_label = f'"{text}"' if self.shape != "plain" else f"<{text}>"
-        return f'"{self.internal_name}" [label={dot_label}, color="{self.color}", shape="{self.shape}"];'
+        return f'"{self.internal_name}" [label={dot_label}, color="{self._color_str}", shape="{self.shape}"];'
+
+
+# dot-attribute fragments shared by every rendered node and edge; interned so
+# the joins below reuse a single string object per literal instead of having
+# the f-string machinery copy it on each call
+_LABEL_EQ = sys.intern(" [label=")
+_LABEL_STR_EQ = sys.intern(' [label="')
+_COLOR_EQ = sys.intern(', color="')
+_Q_COLOR_EQ = sys.intern('", color="')
+_SHAPE_EQ = sys.intern('", shape="')
+_ATTRS_END = sys.intern('"];')
 
 
 class Node:
@@ -224,9 +278,13 @@ class Node:
         if internal_name is None:
             internal_name = label
         self.internal_name = internal_name
+        # quoted once here; interpolated into every edge touching this node
+        self._quoted_name = f'"{internal_name}"'
         self.label = label
         self.label_size = label_size
         self.color = color
+        # callers pass either a hex string or a `Color`; normalize once
+        self._color_str = str(color)
         self.shape = shape
         self.additional_lines = additional_lines
         self.additional_lines_format = additional_lines_formats or []
@@ -245,8 +303,20 @@ class Node:
             for line, fmt_dict in zip(self.additional_lines, self.additional_lines_format):
                 format_attrs = ' '.join(f'{k}="{v}"' for k, v in fmt_dict.items())
                 label_content += f'<FONT {format_attrs}>{line}</FONT><BR/>'
-        dot_label = f'<{label_content}>'
-        return f'"{self.internal_name}" [label={dot_label}, color="{self.color}", shape="{self.shape}"];'
+        return "".join(
+            (
+                self._quoted_name,
+                _LABEL_EQ,
+                "<",
+                label_content,
+                ">",
+                _COLOR_EQ,
+                self._color_str,
+                _SHAPE_EQ,
+                self.shape,
+                _ATTRS_END,
+            )
+        )
 
 
 class Edge:
@@ -264,6 +334,8 @@ class Edge:
         self.source_node = source_node
         self.target_node = target_node
         self.color = color
+        # interpolated into every rendered edge; stringify the color once
+        self._color_str = str(color)
         self.label = label
         self.source_port = source_port
         self.target_port = target_port
@@ -271,18 +343,25 @@ class Edge:
         self.arrowhead = arrowhead
 
     def to_dot_string(self) -> str:
-        source = f'"{self.source_node.internal_name}"'
-        target = f'"{self.target_node.internal_name}"'
-        if self.source_port is not None:
-            source += f":{self.source_port}"
-        if self.target_port is not None:
-            target += f":{self.target_port}"
-        attrs = [f'label="{self.label}"', f'color="{self.color}"']
+        # single f-strings per endpoint instead of building them up with `+=`,
+        # reusing the quoting done once in the Node constructor
+        source = (
+            self.source_node._quoted_name
+            if self.source_port is None
+            else f"{self.source_node._quoted_name}:{self.source_port}"
+        )
+        target = (
+            self.target_node._quoted_name
+            if self.target_port is None
+            else f"{self.target_node._quoted_name}:{self.target_port}"
+        )
+        parts = [source, " -> ", target, _LABEL_STR_EQ, self.label, _Q_COLOR_EQ, self._color_str]
         if self.arrowtail is not None:
-            attrs.append(f'arrowtail="{self.arrowtail}"')
+            parts += ('", arrowtail="', self.arrowtail)
         if self.arrowhead is not None:
-            attrs.append(f'arrowhead="{self.arrowhead}"')
-        return f"{source} -> {target} [{', '.join(attrs)}];"
+            parts += ('", arrowhead="', self.arrowhead)
+        parts.append(_ATTRS_END)
+        return "".join(parts)
 
 
 class Group:
@@ -334,19 +413,42 @@ def dict_to_dot_string(d: Dict[str, Any]) -> str:
     return ",".join([f'{k}="{v}"' for k, v in d.items()])
 
 
-def _get_group_string_shallow(group: Group, children_string: str) -> str:
-    nodes_string = " ".join([f'"{node.internal_name}"' for node in group.nodes])
-    return f'subgraph "cluster_{group.label}" {{style="rounded"; label="{group.label}"; color="{group.border_color}"; {nodes_string};\n {children_string} }}'
+# the node/edge configs never change, so serialize them once at import time;
+# only `rankdir` varies in the graph config, so cache per rankdir
+_NODE_CONFIG_STR = f"node [ {dict_to_dot_string(NODE_CONFIG)} ];"
+_EDGE_CONFIG_STR = f"edge [ {dict_to_dot_string(EDGE_CONFIG)} ];"
+
+
+@functools.lru_cache(maxsize=None)
+def _graph_config_str(rankdir: str) -> str:
+    config = {**GRAPH_CONFIG, "rankdir": rankdir}
+    return f"graph [ {dict_to_dot_string(config)} ];"
 
 
 def get_group_string(group: Group, groups_forest: Dict[Group, List[Group]]) -> str:
-    children = groups_forest.get(group, [])
-    return _get_group_string_shallow(
-        group,
-        children_string="\n".join(
-            [get_group_string(child, groups_forest=groups_forest) for child in children]
-        ),
-    )
+    """
+    Render a group and its nested children with an explicit stack, appending
+    fragments to a single list — the recursive version re-copied each child's
+    rendered blob into its parent at every level of the hierarchy.
+    """
+    out: List[str] = []
+    # (group, entering) pairs: emit the opening on the way down and the
+    # closing brace on the way back up
+    stack: List[Tuple[Group, bool]] = [(group, True)]
+    while stack:
+        g, entering = stack.pop()
+        if not entering:
+            out.append(" }")
+            continue
+        nodes_string = " ".join([f'"{node.internal_name}"' for node in g.nodes])
+        out.append(
+            f'subgraph "cluster_{g.label}" {{style="rounded"; label="{g.label}"; color="{g.border_color}"; {nodes_string};\n '
+        )
+        stack.append((g, False))
+        # reversed so children render in their original order
+        for child in reversed(groups_forest.get(g, [])):
+            stack.append((child, True))
+    return "".join(out)
 
 
 def to_dot_string(
@@ -356,42 +458,59 @@ def to_dot_string(
     rankdir: Literal["TB", "BT", "LR", "RL"] = "TB",
 ) -> str:
     """Converts a graph to a dot string"""
-    joiner = "\n" + " " * 12
-    ### global config
-    graph_config = copy.deepcopy(GRAPH_CONFIG)
-    graph_config["rankdir"] = rankdir
-    graph_config = f"graph [ {dict_to_dot_string(graph_config)} ];"
-    node_config = f"node [ {dict_to_dot_string(NODE_CONFIG)} ];"
-    edge_config = f"edge [ {dict_to_dot_string(EDGE_CONFIG)} ];"
-    preamble = joiner.join([graph_config, node_config, edge_config])
-    ### nodes
-    node_strings = []
-    for node in nodes:
-        node_strings.append(node.to_dot_string())
-    nodes_part = joiner.join(node_strings)
-    ### edges
-    edge_strings = []
-    for edge in edges:
-        edge_strings.append(edge.to_dot_string())
-    edges_part = joiner.join(edge_strings)
     ### groups
-    groups_forest = {
-        group: [g for g in groups if g.parent is group] for group in groups
-    }
-    roots = [group for group in groups if group.parent is None]
-    group_strings = []
-    for group in roots:
-        group_strings.append(get_group_string(group, groups_forest=groups_forest))
-    groups_part = joiner.join(group_strings)
-    result = f"""
-    digraph G {{
-        {preamble}
-        {nodes_part}
-        {edges_part}
-        {groups_part}
-        }}
+    # single O(G) pass instead of scanning all groups once per group
+    groups_forest: Dict[Group, List[Group]] = defaultdict(list)
+    roots = []
+    for group in groups:
+        if group.parent is None:
+            roots.append(group)
+        else:
+            groups_forest[group.parent].append(group)
+    # collect every fragment — including the digraph delimiters — into one
+    # list and join once, instead of building the config/node/edge/group
+    # sections separately and re-copying them into a final template (the
+    # cosmetic 12-space indentation only added bytes to the dot input)
+    parts = [
+        "digraph G {",
+        _graph_config_str(rankdir),
+        _NODE_CONFIG_STR,
+        _EDGE_CONFIG_STR,
+    ]
+    parts.extend(node.to_dot_string() for node in nodes)
+    parts.extend(edge.to_dot_string() for edge in edges)
+    parts.extend(
+        get_group_string(group, groups_forest=groups_forest) for group in roots
+    )
+    parts.append("}")
+    return "\n".join(parts)
+
+
+@functools.lru_cache(maxsize=64)
+def _render_dot(dot_string: str, output_ext: str) -> Optional[bytes]:
     """
-    return result
+    Run `dot` once for a given source/format and cache the rendered bytes:
+    re-displaying or re-exporting an unchanged graph (common in notebook
+    workflows) then costs a cache lookup instead of another fork/exec of the
+    dot process. Returns `None` when graphviz is not installed.
+    """
+    # pipe the source straight into dot: no temp input file to write and
+    # re-read, no shell to parse the command (which also broke on output
+    # paths containing spaces)
+    try:
+        return subprocess.run(
+            ["dot", "-T", output_ext],
+            input=dot_string.encode(),
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+    except FileNotFoundError:
+        # missing graphviz used to fail silently through the shell; warn
+        # instead, but let actual render errors propagate via check=True
+        logger.warning(
+            "Could not find the `dot` executable; is graphviz installed?"
+        )
+        return None
 
 
 def write_output(
@@ -404,16 +523,16 @@ def write_output(
     Writes the given dot string to a dot file (temp file by default) and then
     optionally shows it in the browser, opens it in a program, or does nothing.
     """
-    # make a temp file and write the dot string to it
     if output_path is None:
+        # imported here (like the other display helpers below) so that
+        # importing the module for dot-string generation alone stays cheap
+        import tempfile
+
         tfile = tempfile.NamedTemporaryFile(suffix=f".{output_ext}", delete=False)
         output_path = Path(tfile.name)
-    with tempfile.NamedTemporaryFile(mode="w", delete=True) as f:
-        path = f.name
-        with open(path, "w") as f:
-            f.write(dot_string)
-        cmd = f"dot -T {output_ext} -o {output_path} {path}"
-        subprocess.call(cmd, shell=True)
+    rendered = _render_dot(dot_string, output_ext)
+    if rendered is not None:
+        output_path.write_bytes(rendered)
     if show_how == "browser":
         assert output_ext in [
             "png",
@@ -421,9 +540,14 @@ def write_output(
             "jpeg",
             "svg",
         ], "Can only show png, jpg, jpeg, or svg in browser"
+        import webbrowser
+
         webbrowser.open(str(output_path))
         return
     elif show_how == "inline":
+        from graphviz import Source
+        from IPython import display
+
         src = Source(dot_string)
         display.display(src)
     elif show_how == "none":